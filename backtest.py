@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ICU Prediction API: Backtest.
+
+Replays the prediction model over all historical admissions: for every patient, the risk is
+computed at every measurement time, using only the signal values known at that time.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+from time import perf_counter
+import pandas as pd
+from src.icu_model import ICUModel
+from src.logger import get_logger
+from src.patient_prediction_engine import PatientPredictionEngine
+
+SECONDS_IN_HOUR = 3600
+
+# Amount of shards per worker process; more shards than workers balances the load when some
+# patients stay (much) longer than others
+SHARDS_PER_WORKER = 4
+
+DEFAULT_OUTPUT_PATH = "backtest_results.csv"
+
+# Define a logger
+LOGGER = get_logger('Backtest')
+
+
+def backtest_patients(patient_ids):
+    """Compute the risk at every measurement time for a shard of patients.
+
+    Parameters
+    ----------
+    patient_ids : List[int]
+        The IDs of the patients in this shard.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, float]
+        A dataframe with the columns 'patient_id', 'time', 'risk_probability' and the features,
+        and the amount of patient-hours that were replayed.
+
+    """
+
+    # Every worker process needs its own database connection
+    icu_model_obj = ICUModel()
+
+    df_results = []
+    patient_hours = 0
+
+    for patient_id in patient_ids:
+
+        prediction_engine_obj = PatientPredictionEngine(patient_id, icu_model_obj)
+        df_records = prediction_engine_obj.get_df_records()
+        if df_records.empty:
+            continue
+
+        df_features = prediction_engine_obj.get_features_over_time(df_records)
+        df_features['risk_probability'] = prediction_engine_obj.predict_batch(df_features)
+        df_features['patient_id'] = patient_id
+        df_results.append(df_features.rename_axis('time').reset_index())
+
+        stay_duration = df_records['time'].max() - \
+            prediction_engine_obj.patient['datetime_admission']
+        patient_hours += max(stay_duration.total_seconds(), 0) / SECONDS_IN_HOUR
+
+    if not df_results:
+        return pd.DataFrame(), patient_hours
+
+    return pd.concat(df_results, ignore_index=True), patient_hours
+
+
+def run_backtest(output_path, workers):
+    """Run the backtest over all patients and write the results to a CSV file.
+
+    Parameters
+    ----------
+    output_path : str
+        Path of the CSV file to write the results to.
+    workers : int
+        Amount of worker processes.
+
+    """
+
+    # General strategy:
+    # 1. Get all patients that have ever been admitted
+    # 2. Split the patients in shards and backtest the shards in a process pool
+    # 3. Combine the results of all shards and write them to the output file
+    # 4. Report the throughput
+
+    icu_model_obj = ICUModel()
+    patient_ids = [patient['id'] for patient in icu_model_obj.get_patients()]
+    del icu_model_obj
+
+    amount_of_shards = max(min(len(patient_ids), workers * SHARDS_PER_WORKER), 1)
+    shards = [patient_ids[i::amount_of_shards] for i in range(amount_of_shards)]
+
+    LOGGER.info("Backtesting %d patients with %d workers.", len(patient_ids), workers)
+    start = perf_counter()
+
+    df_results = []
+    patient_hours = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for df_shard, shard_patient_hours in executor.map(backtest_patients, shards):
+            df_results.append(df_shard)
+            patient_hours += shard_patient_hours
+
+    df_results = pd.concat(df_results, ignore_index=True, sort=False)
+    if not df_results.empty:
+        df_results = df_results.sort_values(by=['patient_id', 'time'])
+        df_results = df_results[['patient_id', 'time', 'risk_probability', 'age',
+                                 'blood_pressure__last', 'respiration_rate__mean',
+                                 'temperature__std']]
+    df_results.to_csv(output_path, index=False)
+
+    elapsed = perf_counter() - start
+    LOGGER.info("Wrote %d predictions to %s in %.1f seconds.",
+                len(df_results), output_path, elapsed)
+    LOGGER.info("Throughput: %.1f patient-hours per second.", patient_hours / elapsed)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH,
+                        help="Path of the CSV file to write the results to.")
+    parser.add_argument('--workers', type=int, default=cpu_count(),
+                        help="Amount of worker processes (defaults to the amount of CPUs).")
+    arguments = parser.parse_args()
+
+    run_backtest(arguments.output, arguments.workers)
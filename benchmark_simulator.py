@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ICU Prediction API: Simulator benchmark.
+
+Runs the simulator as fast as possible (without sleeping) with logging enabled and with logging
+disabled, to measure the overhead of logging. Be aware that this deletes all patients and signal
+values in the database, which is why it only runs with --reset.
+"""
+
+from argparse import ArgumentParser
+from random import seed
+from time import perf_counter
+import logging
+from numpy import random as numpy_random
+from src.logger import get_logger, QUEUE_HANDLER
+from simulator import Simulator, IC_AVERAGE_PATIENT_AMOUNT
+
+SEED = 42
+DEFAULT_SIMULATED_MINUTES = 1440
+
+LOGGER = get_logger('Simulator benchmark')
+
+
+def time_simulation(simulator_obj, simulated_minutes):
+    """Simulate a number of minutes from a fresh simulation and return the elapsed seconds.
+
+    Parameters
+    ----------
+    simulator_obj : Simulator
+        An instance of the Simulator class.
+    simulated_minutes : int
+        Amount of minutes to simulate.
+
+    Returns
+    -------
+    float
+        Elapsed (wall clock) seconds.
+
+    """
+
+    # Make every run simulate exactly the same admissions and measurements
+    seed(SEED)
+    numpy_random.seed(SEED)
+    simulator_obj.faker_obj.seed_instance(SEED)
+    simulator_obj.reset_simulation()
+
+    for _ in range(IC_AVERAGE_PATIENT_AMOUNT):
+        simulator_obj.possibly_admit_patient(always_admit=True)
+
+    start = perf_counter()
+    for _ in range(simulated_minutes):
+        simulator_obj.simulate_minute()
+
+    # Include the time the background thread needs to write the records that are still queued
+    QUEUE_HANDLER.queue.join()
+
+    return perf_counter() - start
+
+
+def run_benchmark(simulated_minutes, repeats):
+    """Benchmark the simulator with and without logging and log the overhead of logging.
+
+    Parameters
+    ----------
+    simulated_minutes : int
+        Amount of minutes to simulate per run.
+    repeats : int
+        Amount of runs per configuration (the fastest run is used).
+
+    """
+
+    simulator_obj = Simulator()
+    available_beds = list(simulator_obj.available_beds)
+    start_datetime = simulator_obj.current_datetime
+
+    timings = {"with logging": [], "without logging": []}
+    for _ in range(repeats):
+        for configuration in timings:
+
+            simulator_obj.available_beds = list(available_beds)
+            simulator_obj.patients_in_ic = []
+            simulator_obj.current_datetime = start_datetime
+
+            if configuration == "without logging":
+                logging.disable(logging.CRITICAL)
+            timings[configuration].append(time_simulation(simulator_obj, simulated_minutes))
+            logging.disable(logging.NOTSET)
+
+    with_logging = min(timings["with logging"])
+    without_logging = min(timings["without logging"])
+
+    LOGGER.info("Simulated %d minutes in %.2f seconds with logging and %.2f seconds without.",
+                simulated_minutes, with_logging, without_logging)
+    LOGGER.info("Logging overhead: %.1f%% (%.1f microseconds per simulated minute).",
+                100 * (with_logging - without_logging) / without_logging,
+                10**6 * (with_logging - without_logging) / simulated_minutes)
+    LOGGER.info("Log records dropped because the queue was full: %d.", QUEUE_HANDLER.dropped)
+
+
+if __name__ == '__main__':
+
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument('--minutes', type=int, default=DEFAULT_SIMULATED_MINUTES,
+                        help="Amount of minutes to simulate per run (defaults to a day).")
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="Amount of runs with and without logging.")
+    parser.add_argument('--reset', action='store_true',
+                        help="Confirm that all patients and signal values in the database may be "
+                             "deleted.")
+    arguments = parser.parse_args()
+
+    if not arguments.reset:
+        parser.error("this deletes all patients and signal values in the database, "
+                     "pass --reset to confirm")
+
+    run_benchmark(arguments.minutes, arguments.repeats)
@@ -24,6 +24,24 @@ SET time_zone = "+00:00";
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `heartbeat`
+--
+
+CREATE TABLE `heartbeat` (
+  `id` tinyint(4) NOT NULL,
+  `time` datetime(6) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+--
+-- Dumping data for table `heartbeat`
+--
+
+INSERT INTO `heartbeat` (`id`, `time`) VALUES
+(1, UTC_TIMESTAMP(6));
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `patients`
 --
@@ -79,6 +97,12 @@ INSERT INTO `signals` (`id`, `name`, `population_mean`, `population_std`) VALUES
 -- Indexes for dumped tables
 --
 
+--
+-- Indexes for table `heartbeat`
+--
+ALTER TABLE `heartbeat`
+  ADD PRIMARY KEY (`id`);
+
 --
 -- Indexes for table `patients`
 --
@@ -124,6 +148,16 @@ ALTER TABLE `patient_signal_values`
 --
 ALTER TABLE `signals`
   MODIFY `id` int(11) NOT NULL AUTO_INCREMENT, AUTO_INCREMENT=4;
+
+--
+-- Events
+--
+
+--
+-- The heartbeat is replicated, the read replicas use its age to measure their lag
+--
+CREATE EVENT `heartbeat` ON SCHEDULE EVERY 1 SECOND
+  DO UPDATE `heartbeat` SET `time` = UTC_TIMESTAMP(6) WHERE `id` = 1;
 COMMIT;
 
 /*!40101 SET CHARACTER_SET_CLIENT=@OLD_CHARACTER_SET_CLIENT */;
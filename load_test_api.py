@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""ICU Prediction API: Load test.
+
+Runs the API against a deliberately slow stand-in for the database and checks the admission
+control: heavy prediction traffic is throttled while /api/get_patients_in_ic keeps being served,
+requests that pass their deadline get a 503 with a Retry-After header, and exports keep their slot
+until their stream is closed. The stand-in answers the queries of the API with fixed data, so this
+doesn't need (or touch) a database.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from threading import Thread
+from time import perf_counter, sleep
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import logging
+import re
+import MySQLdb
+from werkzeug.serving import make_server
+from src import mysql_adapter
+from src.api import app, ENDPOINT_LIMITERS, EXPORT_LIMITER
+from src.logger import get_logger
+
+HOST = '127.0.0.1'
+PORT = 5050
+
+DATETIME_ADMISSION = datetime(2019, 1, 1)
+PATIENT = {'id': 1, 'first_name': 'Milan', 'last_name': 'van den Brink', 'age': 64,
+           'bed': 'BED_01', 'datetime_admission': DATETIME_ADMISSION, 'datetime_discharge': None}
+SIGNAL_NAMES = ['blood_pressure', 'respiration_rate', 'temperature']
+
+MAX_EXECUTION_TIME_PATTERN = re.compile(r'/\*\+ MAX_EXECUTION_TIME\((\d+)\) \*/')
+
+# Exports of the stand-in are this long, so a client that doesn't read keeps its export running
+EXPORT_MINUTES = 10**7
+
+LOGGER = get_logger('Load test')
+
+
+class SlowDatabase:
+    """Stand-in for the MySQL server that takes `delay` seconds for every query.
+
+    Like MySQL, it aborts a query with error 3024 when it runs longer than the MAX_EXECUTION_TIME
+    hint of the query.
+
+    Attributes
+    ----------
+    delay : float
+        Amount of seconds every query takes.
+
+    """
+
+    def __init__(self, delay):
+
+        self.delay = delay
+
+    def connect(self, **config):
+        """Connect to the stand-in."""
+
+        return SlowConnection(self)
+
+
+class SlowConnection:
+    """Connection to the SlowDatabase."""
+
+    def __init__(self, database):
+
+        self.database = database
+
+    def cursor(self, cursor_class=None):
+        """Get a cursor."""
+
+        return SlowCursor(self)
+
+    def autocommit(self, on):
+        """Set autocommit."""
+
+    def commit(self):
+        """Commit."""
+
+    def close(self):
+        """Close the connection."""
+
+
+class SlowCursor:
+    """Cursor of the SlowDatabase, answers the queries of the API with fixed data."""
+
+    def __init__(self, connection):
+
+        self.connection = connection
+        self.rows = []
+        self.lastrowid = None
+
+    def execute(self, query, params=None):
+        """Execute a query, taking the delay of the database."""
+
+        hint = MAX_EXECUTION_TIME_PATTERN.search(query)
+        limit = int(hint.group(1)) / 1000 if hint else None
+        if limit is not None and limit < self.connection.database.delay:
+            sleep(limit)
+            raise MySQLdb.OperationalError(mysql_adapter.ER_QUERY_TIMEOUT,
+                                           "Query execution was interrupted")
+        sleep(self.connection.database.delay)
+
+        if "MAX(time)" in query:
+            self.rows = [{'MAX(time)': DATETIME_ADMISSION + timedelta(hours=10)}]
+        elif "FROM patients" in query:
+            self.rows = [PATIENT]
+        elif "patient_ids" in query:
+            self.rows = self.generate_signal_values(EXPORT_MINUTES)
+        else:
+            self.rows = list(self.generate_signal_values(600))
+
+    @staticmethod
+    def generate_signal_values(minutes):
+        """Generate a value for every signal every ten minutes."""
+
+        return (
+            {'patient_id': PATIENT['id'], 'name': name, 'value': 37.0 + minute % 7,
+             'time': DATETIME_ADMISSION + timedelta(minutes=minute)}
+            for minute in range(0, minutes, 10)
+            for name in SIGNAL_NAMES
+        )
+
+    def fetchone(self):
+        """Fetch a row."""
+
+        return self.rows[0]
+
+    def fetchall(self):
+        """Fetch all rows."""
+
+        return self.rows
+
+    def fetchmany(self, size):
+        """Fetch a batch of rows."""
+
+        return list(islice(self.rows, size))
+
+    def close(self):
+        """Close the cursor."""
+
+
+def get(path, read_body=True):
+    """Call the API.
+
+    Returns
+    -------
+    Tuple[int, float, HTTPResponse]
+        The status code, the amount of seconds until the headers arrived and the response (None
+        when the body was read).
+
+    """
+
+    start = perf_counter()
+    try:
+        response = urlopen(f"http://{HOST}:{PORT}{path}")
+    except HTTPError as error:
+        error.read()
+        return error.code, perf_counter() - start, None
+
+    elapsed = perf_counter() - start
+    if read_body:
+        response.read()
+        response.close()
+        return response.status, elapsed, None
+
+    return response.status, elapsed, response
+
+
+def summarize(endpoint, results):
+    """Log the status codes and latencies of a list of (status, seconds, response) results."""
+
+    for status in sorted(set(result[0] for result in results)):
+        latencies = [result[1] for result in results if result[0] == status]
+        LOGGER.info("%s: %d x %d, latency up to %.2f seconds.",
+                    endpoint, len(latencies), status, max(latencies))
+
+
+def check(condition, description):
+    """Log whether an expectation of the load test holds."""
+
+    if condition:
+        LOGGER.info("OK: %s", description)
+    else:
+        LOGGER.error("FAILED: %s", description)
+
+    return condition
+
+
+def run_throttling_test(database):
+    """Flood the prediction endpoint and check that the cheap endpoint keeps being served."""
+
+    database.delay = 0.5
+    prediction_limiter = ENDPOINT_LIMITERS['get_prediction_for_single_patient']
+    heavy_requests = 6 * (prediction_limiter.max_concurrent + prediction_limiter.max_queued)
+
+    with ThreadPoolExecutor(max_workers=heavy_requests + 10) as executor:
+        predictions = [executor.submit(get, '/api/get_prediction_for_single_patient/1')
+                       for _ in range(heavy_requests)]
+        sleep(0.3)
+        patients = [executor.submit(get, '/api/get_patients_in_ic') for _ in range(10)]
+        predictions = [future.result() for future in predictions]
+        patients = [future.result() for future in patients]
+
+    summarize('get_prediction_for_single_patient', predictions)
+    summarize('get_patients_in_ic', patients)
+
+    shed = [result for result in predictions if result[0] == 503]
+    return all([
+        check(shed and max(result[1] for result in shed) < database.delay,
+              "excess predictions are rejected before the database is queried"),
+        check(all(result[0] == 200 for result in patients),
+              "get_patients_in_ic keeps being served"),
+    ])
+
+
+def run_deadline_test(database):
+    """Make the database slower than the deadline and check that the request is rejected."""
+
+    limiter = ENDPOINT_LIMITERS['get_patients_in_ic']
+    database.delay = limiter.timeout + 1
+
+    status, elapsed, _ = get('/api/get_patients_in_ic')
+    LOGGER.info("get_patients_in_ic with a %.1f second database: %d after %.2f seconds.",
+                database.delay, status, elapsed)
+
+    return check(status == 503 and elapsed < limiter.timeout + 0.5,
+                 "a request is rejected at its deadline")
+
+
+def run_export_slots_test(database):
+    """Keep exports open without reading them and check that they keep their slot."""
+
+    database.delay = 0.1
+    open_exports = [get('/api/patients/1/signals', read_body=False)
+                    for _ in range(EXPORT_LIMITER.max_concurrent)]
+
+    status_while_open, elapsed, _ = get('/api/patients/1/signals')
+    LOGGER.info("Export while %d exports are open: %d after %.2f seconds.",
+                len(open_exports), status_while_open, elapsed)
+
+    for _, _, response in open_exports:
+        if response is not None:
+            response.close()
+
+    # The server notices the closed connections when it writes the next chunk
+    sleep(1)
+    status_after_close, _, _ = get('/api/patients/1/signals')
+
+    return all([
+        check(all(result[0] == 200 for result in open_exports), "exports start"),
+        check(status_while_open == 503, "an export is rejected while all slots are streaming"),
+        check(status_after_close == 200, "slots are released when the streams are closed"),
+    ])
+
+
+def run_load_test():
+    """Run the API against the slow database stand-in and run the load tests."""
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    database = SlowDatabase(delay=0)
+    with mock.patch.object(mysql_adapter.MySQLdb, 'connect', database.connect), \
+            mock.patch.object(mysql_adapter, 'REPLICAS', []):
+
+        server = make_server(HOST, PORT, app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+
+        results = [run_throttling_test(database), run_deadline_test(database),
+                   run_export_slots_test(database)]
+
+        server.shutdown()
+
+    return all(results)
+
+
+if __name__ == '__main__':
+
+    raise SystemExit(0 if run_load_test() else 1)
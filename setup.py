@@ -14,5 +14,8 @@ setup(
         'numpy==1.16.2',
         'pandas==0.24.2',
         'coloredlogs==10.0'
-    ]
+    ],
+    extras_require={
+        'test': ['pytest==4.4.0']
+    }
 )
@@ -9,10 +9,9 @@ Date: 2019-04-01
 from random import random, choice, randrange
 from datetime import datetime, timedelta
 from time import sleep
-import logging
 from numpy.random import normal
 from faker import Faker
-import coloredlogs
+from src.logger import get_logger
 from src.mysql_adapter import MySQL
 
 SECONDS_IN_MINUTE = 60
@@ -42,9 +41,9 @@ AVAILABLE_BEDS = ['BED_01', 'BED_02', 'BED_03', 'BED_04', 'BED_05', 'BED_06', 'B
                   'BED_17', 'BED_18', 'BED_19', 'BED_20', 'BED_21', 'BED_22', 'BED_23', 'BED_24']
 IC_AVERAGE_PATIENT_AMOUNT = int(len(AVAILABLE_BEDS) / 2)
 
-# Define a logger
-LOGGER = logging.getLogger('Simulator')
-coloredlogs.install(logger=LOGGER)
+# Define the loggers, the clock ticks every simulated minute so it only logs once per second
+LOGGER = get_logger('Simulator')
+CLOCK_LOGGER = get_logger('Simulator clock', max_per_second=1)
 
 
 class Simulator:
@@ -119,7 +118,7 @@ class Simulator:
 
             patient['id'] = self.mysql_obj.replace_into(table_name='patients', values=patient)
             self.patients_in_ic.append(patient)
-            LOGGER.info(f"Patient admitted to the IC in bed: {bed}.")
+            LOGGER.info("Patient admitted to the IC in bed: %s.", bed)
 
     def possibly_discharge_patient(self):
         """Discharge a random patient."""
@@ -163,7 +162,8 @@ class Simulator:
         #    1.1 Loop over all signals that are in the simulation
         #        1.1.1 For each signal build the row-object
         #              The value is drawn from a normal distribution with population meand and std
-        #        1.1.2 Replace the row into the database
+        #        1.1.2 Replace the row into the database (the MySQL adapter logs a periodic
+        #              summary of the rows written, instead of a line per row)
 
         for patient in self.patients_in_ic:
 
@@ -178,14 +178,24 @@ class Simulator:
                         'value': normal(signal['population_mean'], signal['population_std'])
                     }
 
-                    LOGGER.info(f"{signal['name']} with value {row['value']} registered for {patient['first_name']}.")
                     self.mysql_obj.replace_into(table_name='patient_signal_values', values=row)
 
     def next_minute(self):
         """Increase the current datetime with one minute."""
 
         self.current_datetime = self.current_datetime + timedelta(seconds=SECONDS_IN_MINUTE)
-        LOGGER.info(f"Current time: {self.current_datetime}")
+        CLOCK_LOGGER.info("Current time: %s", self.current_datetime)
+
+    def simulate_minute(self):
+        """Simulate a single minute at the IC."""
+
+        self.possibly_discharge_patient()
+
+        self.simulate_values_for_patients_in_ic()
+
+        self.possibly_admit_patient()
+
+        self.next_minute()
 
     @staticmethod
     def decision(probability: float):
@@ -229,13 +239,7 @@ def run_simulation():
 
     while True:
 
-        simulator_obj.possibly_discharge_patient()
-
-        simulator_obj.simulate_values_for_patients_in_ic()
-
-        simulator_obj.possibly_admit_patient()
-
-        simulator_obj.next_minute()
+        simulator_obj.simulate_minute()
 
         sleep(SLOW_FACTOR)
 
@@ -0,0 +1,84 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Admission control.
+
+Limits the amount of requests that are handled at the same time per endpoint, so a slow endpoint
+can't take all resources from the others. Requests wait for a free slot until their deadline, and
+are rejected right away when too many requests are already waiting.
+"""
+
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+
+
+class EndpointLimiter:
+    """Concurrency limit for an endpoint.
+
+    Parameters
+    ----------
+    max_concurrent : int
+        Maximum amount of requests that are handled at the same time.
+    max_queued : int
+        Maximum amount of requests that wait for a free slot, more requests are rejected.
+    timeout : float
+        Amount of seconds a request may take (including waiting for a slot).
+    retry_after : int
+        Amount of seconds after which a rejected client should retry.
+
+    Attributes
+    ----------
+    slots : BoundedSemaphore
+        One slot per request that can be handled at the same time.
+    queued : int
+        Amount of requests that are currently waiting for a slot.
+
+    """
+
+    def __init__(self, max_concurrent, max_queued, timeout, retry_after):
+
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.slots = BoundedSemaphore(max_concurrent)
+        self.queued = 0
+        self.lock = Lock()
+
+    def get_deadline(self):
+        """Get the deadline for a request that starts now (as a monotonic time)."""
+
+        return monotonic() + self.timeout
+
+    def acquire(self, deadline):
+        """Wait for a free slot until the deadline.
+
+        Parameters
+        ----------
+        deadline : float
+            Monotonic time until which to wait.
+
+        Returns
+        -------
+        bool
+            Whether a slot was acquired (if so, it should be released with release).
+
+        """
+
+        # Don't queue when there's a free slot, so max_queued only limits the waiting requests
+        if self.slots.acquire(blocking=False):
+            return True
+
+        with self.lock:
+            if self.queued >= self.max_queued:
+                return False
+            self.queued += 1
+
+        try:
+            return self.slots.acquire(timeout=max(deadline - monotonic(), 0))
+        finally:
+            with self.lock:
+                self.queued -= 1
+
+    def release(self):
+        """Release a slot."""
+
+        self.slots.release()
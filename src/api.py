@@ -6,27 +6,100 @@ Author: Bas Vonk
 Date: 2019-04-01
 """
 
-from flask import Flask, jsonify, request, g, render_template
+import json
+import zlib
+from datetime import datetime
+from flask import Flask, Response, abort, jsonify, request, g, render_template
+from src.admission_control import EndpointLimiter
+from src.mysql_adapter import DeadlineExceeded
 from src.patient_prediction_engine import PatientPredictionEngine
 from src.icu_model import ICUModel
 
+# Concurrency limits and deadlines per endpoint. Predictions and exports are heavy, so they get
+# few slots of their own: when the database is slow they are throttled, while the cheap endpoints
+# keep being served. An export keeps its slot (and a database connection) until its stream is
+# closed, so only a few exports can run at the same time
+EXPORT_LIMITER = EndpointLimiter(max_concurrent=2, max_queued=4, timeout=5, retry_after=30)
+ENDPOINT_LIMITERS = {
+    'dashboard': EndpointLimiter(max_concurrent=8, max_queued=16, timeout=5, retry_after=2),
+    'get_patients_in_ic': EndpointLimiter(max_concurrent=16, max_queued=32, timeout=2,
+                                          retry_after=1),
+    'get_prediction_for_single_patient': EndpointLimiter(max_concurrent=4, max_queued=8,
+                                                         timeout=10, retry_after=5),
+    'get_signals_for_patient': EXPORT_LIMITER,
+    'get_signals_for_patients': EXPORT_LIMITER,
+}
+DEFAULT_LIMITER = EndpointLimiter(max_concurrent=8, max_queued=16, timeout=5, retry_after=1)
+
+# Amount of NDJSON lines that are joined into a single chunk before it is sent to the client
+EXPORT_LINES_PER_CHUNK = 500
+
 # Initialize the app and define the folder with the builds and static files
 app = Flask(__name__)
 
 
+def service_unavailable(detail, retry_after):
+    """Build a 503 response that tells the client when to retry."""
+
+    response = jsonify({"errors": [{"detail": detail}]})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@app.errorhandler(400)
+def bad_request(error):
+    """Describe invalid parameters in the same format as the other errors of the API."""
+
+    response = jsonify({"errors": [{"detail": error.description}]})
+    response.status_code = 400
+    return response
+
+
+@app.before_request
+def admit_request():
+    """Before every call, wait for a free slot for the endpoint (or reject the call)."""
+
+    limiter = ENDPOINT_LIMITERS.get(request.endpoint, DEFAULT_LIMITER)
+    g.deadline = limiter.get_deadline()
+    g.retry_after = limiter.retry_after
+
+    if not limiter.acquire(g.deadline):
+        return service_unavailable("Too many requests, try again later.", limiter.retry_after)
+
+    g.limiter = limiter
+
+
 @app.before_request
 def get_icu_model():
     """Before every call, get an instance of the ICUModel."""
 
-    g.icu_model_obj = ICUModel()
+    g.icu_model_obj = ICUModel(deadline=g.deadline)
     g.current_datetime = g.icu_model_obj.get_current_simulated_time()
 
 
+@app.errorhandler(DeadlineExceeded)
+def deadline_exceeded(error):
+    """Reject calls for which the database did not respond before the deadline."""
+
+    return service_unavailable("The database did not respond in time, try again later.",
+                               g.retry_after)
+
+
+@app.teardown_request
+def release_request(error):
+    """Release the slot of the endpoint after every call."""
+
+    limiter = g.pop('limiter', None)
+    if limiter is not None:
+        limiter.release()
+
+
 @app.teardown_appcontext
 def close_connection(error):
     """Delete the ICUModel instance after every call (also closing the MySQL connection)."""
 
-    del g.icu_model_obj
+    g.pop('icu_model_obj', None)
 
 
 @app.route('/dashboard')
@@ -112,5 +185,134 @@ def get_prediction_for_single_patient(patient_id):
     return jsonify(response)
 
 
+def parse_datetime_arg(name):
+    """Parse an optional ISO 8601 datetime from the query string (400 if invalid)."""
+
+    value = request.args.get(name)
+    if value is None:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"'{name}' should be an ISO 8601 datetime, e.g. 2019-01-01T00:00:00.")
+
+
+def parse_list_arg(name, value_type=str):
+    """Parse an optional comma separated list from the query string (400 if invalid)."""
+
+    value = request.args.get(name)
+    if not value:
+        return []
+
+    try:
+        return [value_type(item) for item in value.split(',')]
+    except ValueError:
+        abort(400, f"'{name}' should be a comma separated list.")
+
+
+def generate_ndjson(records):
+    """Serialise records to newline delimited JSON, a chunk of lines at a time."""
+
+    lines = []
+    for record in records:
+        record['time'] = record['time'].isoformat()
+        lines.append(json.dumps(record))
+        if len(lines) == EXPORT_LINES_PER_CHUNK:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def generate_gzip(chunks):
+    """Compress a stream of text chunks into a gzip stream."""
+
+    # wbits = 16 + MAX_WBITS writes a gzip header and trailer instead of a zlib one
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk.encode('utf-8'))
+        if compressed:
+            yield compressed
+
+    yield compressor.flush()
+
+
+def stream_signal_values_response(patient_ids):
+    """Build a streaming NDJSON response with the signal values for the patients.
+
+    The time range and signals are taken from the query string parameters 'from', 'to' and
+    'signals'. The response is gzip compressed when the client accepts it.
+    """
+
+    datetime_from = parse_datetime_arg('from')
+    datetime_to = parse_datetime_arg('to')
+    signal_names = parse_list_arg('signals')
+
+    # The export uses its own connection: a server-side cursor blocks its connection until all
+    # rows are read, and the request's connection is closed before the stream starts. Connecting
+    # and starting the query happen here, so a slow database gives a 503 instead of a 200 with a
+    # truncated body
+    icu_model_obj = ICUModel(deadline=g.deadline)
+    records = icu_model_obj.stream_signal_values_for_patients(
+        patient_ids, datetime_from, datetime_to, signal_names)
+
+    body = generate_ndjson(records)
+    headers = {'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.accept_encodings:
+        body = generate_gzip(body)
+        headers['Content-Encoding'] = 'gzip'
+
+    response = Response(body, mimetype='application/x-ndjson', headers=headers)
+
+    # Flask tears the request down before the body is sent, so keep the slot of the endpoint (and
+    # the connection) until the stream is closed
+    limiter = g.pop('limiter')
+    response.call_on_close(icu_model_obj.close_connection)
+    response.call_on_close(limiter.release)
+
+    return response
+
+
+@app.route('/api/patients/<int:patient_id>/signals')
+def get_signals_for_patient(patient_id):
+    """Stream the signal values for a single patient.
+
+    Query string parameters (all optional):
+    - from: ISO 8601 datetime, only values measured at or after this time are returned
+    - to: ISO 8601 datetime, only values measured before this time are returned
+    - signals: comma separated signal names, e.g. blood_pressure,temperature
+
+    Response format (newline delimited JSON, ordered by signal and time):
+    {"patient_id": 490, "name": "blood_pressure", "value": 63.2, "time": "2019-01-01T00:04:00"}
+    {"patient_id": 490, "name": "blood_pressure", "value": 64.8, "time": "2019-01-01T00:14:00"}
+    ...
+    """
+
+    return stream_signal_values_response([patient_id])
+
+
+@app.route('/api/patients/signals')
+def get_signals_for_patients():
+    """Stream the signal values for multiple patients.
+
+    Query string parameters:
+    - patient_ids: comma separated patient IDs, e.g. 490,491,492 (required)
+    - from, to, signals: see /api/patients/<patient_id>/signals
+
+    Response format (newline delimited JSON, ordered by patient, signal and time):
+    {"patient_id": 490, "name": "blood_pressure", "value": 63.2, "time": "2019-01-01T00:04:00"}
+    {"patient_id": 491, "name": "blood_pressure", "value": 66.9, "time": "2019-01-01T00:02:00"}
+    ...
+    """
+
+    patient_ids = parse_list_arg('patient_ids', int)
+    if not patient_ids:
+        abort(400, "'patient_ids' is required.")
+
+    return stream_signal_values_response(patient_ids)
+
+
 if __name__ == "__main__":  # pragma: no cover
     app.run(debug=True, host='0.0.0.0', port=80)
@@ -16,3 +16,12 @@ MYSQL_CONFIG = {
     "use_unicode": True,
     "cursorclass": cursors.DictCursor
 }
+
+# Read replicas (comma separated hostnames), these share the credentials of the primary
+MYSQL_REPLICA_CONFIGS = [
+    {**MYSQL_CONFIG, "host": hostname}
+    for hostname in getenv("MYSQL_REPLICA_HOSTNAMES", "").split(",") if hostname
+]
+
+# Reads only go to a replica that lags less than this amount of seconds behind the primary
+MYSQL_MAX_REPLICA_LAG = float(getenv("MYSQL_MAX_REPLICA_LAG", "5"))
@@ -5,7 +5,8 @@ Author: Bas Vonk
 Date: 2019-04-01
 """
 
-from mysql_adapter import MySQL
+from src.config import MYSQL_MAX_REPLICA_LAG
+from src.mysql_adapter import MySQL
 
 
 class ICUModel:
@@ -15,16 +16,25 @@ class ICUModel:
     ----------
     mysql_obj : MySQL
         An instance of the MySQL adapter.
+    max_staleness : float
+        Maximum amount of seconds the data that is read may lag behind the primary database
+        (0 to always read from the primary, None when any lag is acceptable).
 
     """
 
-    def __init__(self):
+    def __init__(self, max_staleness=MYSQL_MAX_REPLICA_LAG, deadline=None):
 
-        self.mysql_obj = MySQL()
+        self.mysql_obj = MySQL(deadline)
+        self.max_staleness = max_staleness
 
     def __del__(self):
         """When an instance of this class is deleted, close the database connection."""
 
+        self.close_connection()
+
+    def close_connection(self):
+        """Close the database connection (does nothing when it's closed already)."""
+
         self.mysql_obj.close_connection()
 
     def get_patients_in_ic(self):
@@ -32,7 +42,14 @@ class ICUModel:
 
         query = "SELECT * FROM patients WHERE datetime_discharge IS NULL"
 
-        return self.mysql_obj.fetch_rows(query)
+        return self.mysql_obj.fetch_rows(query, max_staleness=self.max_staleness)
+
+    def get_patients(self):
+        """Get all patients that have ever been admitted to the Intensive Care."""
+
+        query = "SELECT * FROM patients ORDER BY id"
+
+        return self.mysql_obj.fetch_rows(query, max_staleness=self.max_staleness)
 
     def get_signal_values_for_patient(self, patient_id):
         """Get all signal values for patient.
@@ -62,7 +79,88 @@ class ICUModel:
             "patient_id": patient_id
         }
 
-        return self.mysql_obj.fetch_rows(query, params)
+        return self.mysql_obj.fetch_rows(query, params, self.max_staleness)
+
+    def stream_signal_values_for_patients(self, patient_ids, datetime_from=None,
+                                          datetime_to=None, signal_names=None):
+        """Stream signal values for one or more patients, ordered by patient, signal and time.
+
+        This order follows the (patient_id, signal_id, time) key, so the database can send the
+        rows as it reads them instead of sorting the whole result first. To keep that key usable,
+        the signals are filtered on their IDs and the join starts from patient_signal_values
+        (STRAIGHT_JOIN), instead of from the (much smaller) signals table.
+
+        Parameters
+        ----------
+        patient_ids : List[int]
+            Patient IDs.
+        datetime_from : datetime
+            Only return values measured at or after this time (optional).
+        datetime_to : datetime
+            Only return values measured before this time (optional).
+        signal_names : List[str]
+            Only return values for these signals (optional).
+
+        Returns
+        -------
+        Iterator[Dict[str, Union[str, int, float, datetime]]]
+            Records with signal values.
+
+        """
+
+        query = \
+            """
+            SELECT psv.patient_id, s.name, psv.value, psv.time
+            FROM patient_signal_values psv
+            STRAIGHT_JOIN signals s
+                ON psv.signal_id = s.id
+            WHERE psv.patient_id IN %(patient_ids)s
+            """
+
+        params = {
+            "patient_ids": tuple(patient_ids)
+        }
+
+        if datetime_from is not None:
+            query += " AND psv.time >= %(datetime_from)s"
+            params["datetime_from"] = datetime_from
+
+        if datetime_to is not None:
+            query += " AND psv.time < %(datetime_to)s"
+            params["datetime_to"] = datetime_to
+
+        if signal_names:
+            signal_ids = self.get_signal_ids(signal_names)
+            if not signal_ids:
+                return iter(())
+            query += " AND psv.signal_id IN %(signal_ids)s"
+            params["signal_ids"] = tuple(signal_ids)
+
+        query += " ORDER BY psv.patient_id, psv.signal_id, psv.time"
+
+        return self.mysql_obj.stream_rows(query, params, max_staleness=self.max_staleness)
+
+    def get_signal_ids(self, signal_names):
+        """Get the IDs of signals.
+
+        Parameters
+        ----------
+        signal_names : List[str]
+            Signal names (names of signals that don't exist are left out).
+
+        Returns
+        -------
+        List[int]
+            Signal IDs.
+
+        """
+
+        query = "SELECT id FROM signals WHERE name IN %(signal_names)s"
+        params = {"signal_names": tuple(signal_names)}
+
+        rows = self.mysql_obj.fetch_rows(query, params, max_staleness=self.max_staleness)
+
+        return [row['id'] for row in rows]
 
     def get_patient(self, patient_id):
         """Get a patient.
@@ -82,11 +180,11 @@ class ICUModel:
         query = "SELECT * FROM patients WHERE id = %(patient_id)s"
         params = {"patient_id": patient_id}
 
-        return self.mysql_obj.fetch_row(query, params)
+        return self.mysql_obj.fetch_row(query, params, self.max_staleness)
 
     def get_current_simulated_time(self):
         """Get the current time when the simulation is running."""
 
         query = "SELECT MAX(time) FROM patient_signal_values"
 
-        return self.mysql_obj.fetch_value(query)
+        return self.mysql_obj.fetch_value(query, max_staleness=self.max_staleness)
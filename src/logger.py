@@ -0,0 +1,250 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Logging.
+
+Log records are put on a queue and written to the terminal by a background thread, so code that
+logs never waits for the terminal. Noisy loggers can be rate limited and sampled, and events that
+happen very often can be counted and logged as a periodic summary instead of one line each.
+"""
+
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+from random import random
+from threading import Lock
+from time import monotonic
+import atexit
+import logging
+import os
+import queue
+import coloredlogs
+
+LOG_LEVEL = logging.INFO
+
+# When the background thread can't keep up, records are dropped instead of blocking the caller
+MAX_QUEUED_RECORDS = 10000
+
+SUMMARY_INTERVAL_SECONDS = 10
+
+# The background thread hands the records to this logger, which writes them to the terminal
+OUTPUT_LOGGER = logging.getLogger('ICU Prediction API output')
+OUTPUT_LOGGER.propagate = False
+coloredlogs.install(logger=OUTPUT_LOGGER)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Handler that puts records on a queue, which is emptied by a background thread.
+
+    Attributes
+    ----------
+    queue : queue.Queue
+        The queue with records that still have to be written.
+    listener : QueueListener
+        The background thread that writes the records.
+    dropped : int
+        Amount of records that were dropped because the queue was full.
+
+    """
+
+    def __init__(self):
+
+        super().__init__(None)
+        self.dropped = 0
+        self.start()
+
+    def start(self):
+        """Create the queue and start the background thread."""
+
+        self.queue = queue.Queue(MAX_QUEUED_RECORDS)
+        self.listener = QueueListener(self.queue, OUTPUT_LOGGER)
+        self.listener.start()
+
+    def stop(self):
+        """Write the remaining records and stop the background thread."""
+
+        try:
+            self.listener.stop()
+        except queue.Full:
+            pass
+
+    def prepare(self, record):
+        """Leave formatting the record to the background thread.
+
+        This means the arguments of a record are formatted after the call that logged it, so
+        don't log objects that are changed right after logging them.
+        """
+
+        return record
+
+    def enqueue(self, record):
+        """Put a record on the queue, or drop it when the queue is full."""
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+QUEUE_HANDLER = NonBlockingQueueHandler()
+atexit.register(QUEUE_HANDLER.stop)
+
+# A forked process (e.g. in a process pool) doesn't inherit the background thread
+os.register_at_fork(after_in_child=QUEUE_HANDLER.start)
+
+
+class RateLimitFilter(logging.Filter):
+    """Filter that samples records and limits the amount of records per second.
+
+    Warnings and errors are never filtered. The amount of filtered records per logger is logged
+    as a periodic summary.
+
+    Parameters
+    ----------
+    max_per_second : float
+        Maximum amount of records per second (None for no limit).
+    sample_rate : float
+        Fraction of the records to keep.
+
+    Attributes
+    ----------
+    suppressed : int
+        Amount of records that were filtered.
+
+    """
+
+    def __init__(self, max_per_second=None, sample_rate=1.0):
+
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.sample_rate = sample_rate
+        self.tokens = max_per_second
+        self.updated_at = monotonic()
+        self.suppressed = 0
+
+    def filter(self, record):
+        """Decide whether a record should be logged."""
+
+        if record.levelno >= logging.WARNING:
+            return True
+
+        if self.sample_rate < 1 and random() >= self.sample_rate:
+            return self.suppress(record)
+
+        if self.max_per_second is not None:
+
+            # Token bucket: tokens are added at max_per_second, each record takes one
+            now = monotonic()
+            self.tokens = min(self.max_per_second,
+                              self.tokens + (now - self.updated_at) * self.max_per_second)
+            self.updated_at = now
+
+            if self.tokens < 1:
+                return self.suppress(record)
+
+            self.tokens -= 1
+
+        return True
+
+    def suppress(self, record):
+        """Count a filtered record (returns False, so filter can return the result)."""
+
+        self.suppressed += 1
+        SUPPRESSED_RECORDS.add(record.name)
+
+        return False
+
+
+class PeriodicSummary:
+    """Count events and log the counts once per interval, instead of logging every event.
+
+    Parameters
+    ----------
+    logger : logging.Logger
+        The logger to log the summaries with.
+    description : str
+        Description of the events, e.g. 'Rows written'.
+    interval : float
+        Amount of seconds between summaries.
+
+    Attributes
+    ----------
+    counts : Counter
+        The amount of events per key since the last summary.
+    started_at : float
+        Monotonic time at which the current interval started.
+
+    """
+
+    def __init__(self, logger, description, interval=SUMMARY_INTERVAL_SECONDS):
+
+        self.logger = logger
+        self.description = description
+        self.interval = interval
+        self.counts = Counter()
+        self.started_at = monotonic()
+        self.lock = Lock()
+
+        atexit.register(self.flush)
+
+    def add(self, key, amount=1):
+        """Count an event, and log the summary when the interval has passed."""
+
+        # Don't spend time counting when the summary won't be logged (e.g. logging is disabled)
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+
+        with self.lock:
+            self.counts[key] += amount
+
+        if monotonic() - self.started_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Log the summary of the current interval and start a new interval."""
+
+        with self.lock:
+            counts = self.counts
+            elapsed = monotonic() - self.started_at
+            self.counts = Counter()
+            self.started_at = monotonic()
+
+        if counts:
+            self.logger.info("%s in the last %.1f seconds: %d (%s)",
+                             self.description, elapsed, sum(counts.values()),
+                             ", ".join(f"{key}: {amount}" for key, amount in counts.items()))
+
+
+def get_logger(name, max_per_second=None, sample_rate=1.0):
+    """Get a logger that writes to the terminal through the background thread.
+
+    Parameters
+    ----------
+    name : str
+        Name of the logger.
+    max_per_second : float
+        Maximum amount of records per second for this logger (None for no limit).
+    sample_rate : float
+        Fraction of the records of this logger to keep.
+
+    Returns
+    -------
+    logging.Logger
+        The logger.
+
+    """
+
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+
+    if QUEUE_HANDLER not in logger.handlers:
+        logger.addHandler(QUEUE_HANDLER)
+
+    for log_filter in [f for f in logger.filters if isinstance(f, RateLimitFilter)]:
+        logger.removeFilter(log_filter)
+
+    if max_per_second is not None or sample_rate < 1:
+        logger.addFilter(RateLimitFilter(max_per_second, sample_rate))
+
+    return logger
+
+
+LOGGER = get_logger('Logging')
+SUPPRESSED_RECORDS = PeriodicSummary(LOGGER, "Log records suppressed by rate limits and sampling")
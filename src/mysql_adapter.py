@@ -5,44 +5,409 @@ Author: Bas Vonk
 Date: 2019-04-01
 """
 
+from itertools import count
+from math import ceil
+import re
+from time import monotonic, sleep
 import MySQLdb
-from src.config import MYSQL_CONFIG
-from time import sleep
-import logging
-import coloredlogs
+from MySQLdb import cursors
+from src.config import MYSQL_CONFIG, MYSQL_REPLICA_CONFIGS, MYSQL_MAX_REPLICA_LAG
+from src.logger import get_logger, PeriodicSummary
 
 MAX_RETRIES = 10
+STREAM_BATCH_SIZE = 1000
 
-LOGGER = logging.getLogger('MySQL adapter')
-coloredlogs.install(logger=LOGGER)
+# A replica that fails is not used for this amount of seconds
+REPLICA_EJECTION_SECONDS = 30
+REPLICA_CONNECT_TIMEOUT_SECONDS = 2
+REPLICA_LAG_CHECK_INTERVAL_SECONDS = 1
+
+# The primary updates the heartbeat table this often (see db_structure.sql)
+HEARTBEAT_INTERVAL_SECONDS = 1
+
+# Error code of a query that was aborted because it exceeded its MAX_EXECUTION_TIME
+ER_QUERY_TIMEOUT = 3024
+
+# The start of a SELECT query, where the optimizer hint with its time limit goes
+SELECT_PATTERN = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+# Error codes of the client library (e.g. 'Lost connection to MySQL server'), these mean that the
+# server can't be reached
+CR_MIN_ERROR = 2000
+CR_MAX_ERROR = 2999
+
+LOGGER = get_logger('MySQL adapter')
+ROWS_WRITTEN = PeriodicSummary(LOGGER, "Rows written")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a database call can't be completed before the deadline."""
+
+
+class Replica:
+    """Health of a read replica, shared by all instances of the MySQL adapter in this process.
+
+    Attributes
+    ----------
+    config : Dict[str, Union[str, bool, type]]
+        Connection configuration of the replica.
+    ejected_until : float
+        Monotonic time until which the replica is not used (after it failed).
+    lag : float
+        Seconds the replica was behind the primary at the last check (None if unknown).
+    lag_checked_at : float
+        Monotonic time of the last lag check (None if never checked).
+    lag_error : str
+        Why the lag could not be measured at the last check (None if it could).
+
+    """
+
+    def __init__(self, config):
+
+        self.config = config
+        self.ejected_until = 0
+        self.lag = None
+        self.lag_checked_at = None
+        self.lag_error = None
+
+    def is_available(self):
+        """Check whether the replica is currently not ejected."""
+
+        return monotonic() >= self.ejected_until
+
+    def eject(self):
+        """Stop using the replica for a while."""
+
+        self.ejected_until = monotonic() + REPLICA_EJECTION_SECONDS
+        self.lag = None
+        self.lag_checked_at = None
+        LOGGER.warning("Replica %s failed, ejected for %d seconds.",
+                       self.config['host'], REPLICA_EJECTION_SECONDS)
+
+    def lag_check_due(self):
+        """Check whether the lag of the replica should be measured again."""
+
+        return self.lag_checked_at is None or \
+            monotonic() - self.lag_checked_at >= REPLICA_LAG_CHECK_INTERVAL_SECONDS
+
+    def get_max_lag(self):
+        """Get how many seconds the replica may be behind the primary now (None if unknown).
+
+        The lag may have grown since it was measured, and the heartbeat it was measured with may
+        already have been up to a heartbeat interval old.
+        """
+
+        if self.lag is None:
+            return None
+
+        return self.lag + (monotonic() - self.lag_checked_at) + HEARTBEAT_INTERVAL_SECONDS
+
+
+REPLICAS = [Replica(config) for config in MYSQL_REPLICA_CONFIGS]
+
+# Used to spread reads over the replicas round-robin
+REPLICA_COUNTER = count()
 
 
 class MySQL:
     """MysQL adapter.
 
+    Writes always go to the primary. Reads go to one of the read replicas (when configured) that
+    lags less than max_staleness seconds behind the primary, or to the primary otherwise.
+
+    Parameters
+    ----------
+    deadline : float
+        Monotonic time after which connecting and reading is given up on with a DeadlineExceeded
+        (None for no deadline).
+
     Attributes
     ----------
     connection : connection
-        MySQL connection
+        MySQL connection to the primary, opened when first used
     cursor : MySQLdb.cursor
-        MySQL cursor
+        MySQL cursor on the primary connection
+    replica_connections : Dict[str, connection]
+        MySQL connections to the read replicas (by hostname), opened when first used
     """
 
-    def __init__(self):
+    def __init__(self, deadline=None):
+
+        self.deadline = deadline
+        self.connection = None
+        self.cursor = None
+        self.replica_connections = {}
+
+    def connect_to_primary(self):
+        """Connect to the primary when there's no connection yet (retrying until the deadline)."""
+
+        if self.connection is not None:
+            return
 
         for i in range(MAX_RETRIES):
             try:
-                self.connection = MySQLdb.connect(**MYSQL_CONFIG)
+                self.connection = self.connect(MYSQL_CONFIG)
+                # Without autocommit, every read would see the snapshot of the first read
+                self.connection.autocommit(True)
                 self.cursor = self.connection.cursor()
-                LOGGER.info(f"Connection succeeded.")
+                LOGGER.info("Connection succeeded.")
                 break
             except MySQLdb.Error:
                 retry_interval = 2**i
-                LOGGER.info(f"Connection failed, retrying in: {retry_interval} seconds.")
+                if self.deadline is not None:
+                    retry_interval = min(retry_interval, self.get_remaining_time())
+                LOGGER.info("Connection failed, retrying in: %d seconds.", retry_interval)
                 sleep(retry_interval)
         else:
             raise SystemError
 
+    def get_remaining_time(self):
+        """Get the amount of seconds until the deadline (raise a DeadlineExceeded if it passed)."""
+
+        remaining_time = self.deadline - monotonic()
+        if remaining_time <= 0:
+            raise DeadlineExceeded
+
+        return remaining_time
+
+    def connect(self, config, connect_timeout=None):
+        """Connect to a database server, giving up at the deadline.
+
+        Parameters
+        ----------
+        config : Dict[str, Union[str, bool, type]]
+            Connection configuration.
+        connect_timeout : int
+            Amount of seconds after which to give up connecting (None for the default).
+
+        Returns
+        -------
+        connection
+            MySQL connection
+
+        Raises
+        ------
+        DeadlineExceeded
+            When connecting failed after the deadline cut the connect timeout short (so the
+            failure doesn't mean the server can't be reached).
+
+        """
+
+        cut_short = False
+        if self.deadline is not None:
+            remaining_time = ceil(self.get_remaining_time())
+            cut_short = connect_timeout is None or remaining_time < connect_timeout
+            connect_timeout = remaining_time if connect_timeout is None \
+                else min(connect_timeout, remaining_time)
+
+        if connect_timeout is not None:
+            config = {**config, "connect_timeout": connect_timeout}
+
+        try:
+            return MySQLdb.connect(**config)
+        except MySQLdb.OperationalError as error:
+            if cut_short and monotonic() >= self.deadline:
+                raise DeadlineExceeded from error
+            raise
+
+    def limit_execution_time(self, query):
+        """Add an optimizer hint to a SELECT query that lets the server abort it at the deadline.
+
+        Unlike SET SESSION max_execution_time, the hint doesn't take a round trip of its own (it
+        needs MySQL 5.7.8 or later).
+
+        Parameters
+        ----------
+        query : str
+            SELECT query
+
+        Returns
+        -------
+        str
+            The query with the hint (the query itself when there's no deadline)
+
+        """
+
+        if self.deadline is None:
+            return query
+
+        milliseconds = max(int(self.get_remaining_time() * 1000), 1)
+
+        return SELECT_PATTERN.sub(f"SELECT /*+ MAX_EXECUTION_TIME({milliseconds}) */", query,
+                                  count=1)
+
+    def get_replica_connection(self, replica):
+        """Get the connection to a replica, connecting when there's no connection yet.
+
+        Parameters
+        ----------
+        replica : Replica
+            The replica to connect to.
+
+        Returns
+        -------
+        connection
+            MySQL connection
+
+        """
+
+        hostname = replica.config['host']
+        if hostname not in self.replica_connections:
+            connection = self.connect(replica.config, REPLICA_CONNECT_TIMEOUT_SECONDS)
+            # Without autocommit, every read would see the snapshot of the first read
+            connection.autocommit(True)
+            self.replica_connections[hostname] = connection
+
+        return self.replica_connections[hostname]
+
+    def drop_replica_connection(self, replica):
+        """Close and forget the connection to a replica (after it failed)."""
+
+        connection = self.replica_connections.pop(replica.config['host'], None)
+        if connection is not None:
+            try:
+                connection.close()
+            except MySQLdb.Error:
+                pass
+
+    def measure_replica_lag(self, replica):
+        """Measure how many seconds a replica is behind the primary (None if unknown).
+
+        The primary writes the current time to the heartbeat table every second (see
+        db_structure.sql), so the age of that time on the replica is its lag. Unlike SHOW SLAVE
+        STATUS, this doesn't need the REPLICATION CLIENT privilege.
+        """
+
+        cursor = self.get_replica_connection(replica).cursor(cursors.DictCursor)
+        cursor.execute("SELECT TIMESTAMPDIFF(MICROSECOND, time, UTC_TIMESTAMP(6)) AS lag "
+                       "FROM heartbeat WHERE id = 1")
+        heartbeat = cursor.fetchone()
+        cursor.close()
+
+        if not heartbeat or heartbeat['lag'] is None:
+            return None
+
+        return max(float(heartbeat['lag']) / 10**6, 0)
+
+    def update_replica_lag(self, replica):
+        """Measure the lag of a replica, ejecting the replica when it can't be reached.
+
+        Other errors (e.g. missing privileges or a missing heartbeat table) don't mean the
+        replica failed, they leave the lag unknown so only reads that accept any lag use it.
+        """
+
+        try:
+            replica.lag = self.measure_replica_lag(replica)
+            replica.lag_error = None
+        except MySQLdb.Error as error:
+            if isinstance(error, MySQLdb.OperationalError) and \
+                    CR_MIN_ERROR <= error.args[0] <= CR_MAX_ERROR:
+                self.drop_replica_connection(replica)
+                replica.eject()
+                return
+            if replica.lag_error != str(error):
+                LOGGER.warning("Lag of replica %s can't be measured: %s",
+                               replica.config['host'], error)
+            replica.lag = None
+            replica.lag_error = str(error)
+
+        replica.lag_checked_at = monotonic()
+
+    def get_read_replicas(self, max_staleness):
+        """Get the replicas that can serve a read, in the order in which they should be tried.
+
+        Parameters
+        ----------
+        max_staleness : float
+            Maximum amount of seconds the replica may lag behind the primary
+            (None when any lag is acceptable).
+
+        Returns
+        -------
+        List[Replica]
+            Available replicas that are recent enough, starting at the next round-robin position.
+
+        """
+
+        if not REPLICAS or max_staleness is not None and max_staleness <= 0:
+            return []
+
+        start = next(REPLICA_COUNTER) % len(REPLICAS)
+        read_replicas = []
+
+        for replica in REPLICAS[start:] + REPLICAS[:start]:
+
+            if not replica.is_available():
+                continue
+
+            if max_staleness is not None:
+                if replica.lag_check_due():
+                    self.update_replica_lag(replica)
+                    # The replica is ejected when it couldn't be reached
+                    if not replica.is_available():
+                        continue
+                max_lag = replica.get_max_lag()
+                if max_lag is None or max_lag >= max_staleness:
+                    continue
+
+            read_replicas.append(replica)
+
+        return read_replicas
+
+    def execute_read(self, query, params=None, max_staleness=MYSQL_MAX_REPLICA_LAG,
+                     cursor_class=None, time_limited=True):
+        """Execute a read query on a replica (or on the primary) and return the cursor.
+
+        Parameters
+        ----------
+        query : str
+            Query
+        params : Dict[str, Union[str, int, float, datetime]]
+            Parameters to be used with the query
+        max_staleness : float
+            Maximum amount of seconds the data may lag behind the primary
+            (0 to always read from the primary, None when any lag is acceptable)
+        cursor_class : type
+            Cursor class to use (defaults to the cursor class of the configuration)
+        time_limited : bool
+            Whether the server should abort the query at the deadline (when False, the deadline
+            only applies to connecting)
+
+        Returns
+        -------
+        MySQLdb.cursor
+            Cursor with the results of the query
+
+        Raises
+        ------
+        DeadlineExceeded
+            When the deadline passes before the query is completed.
+
+        """
+
+        for replica in self.get_read_replicas(max_staleness):
+            try:
+                connection = self.get_replica_connection(replica)
+                cursor = connection.cursor(cursor_class)
+                cursor.execute(self.limit_execution_time(query) if time_limited else query,
+                               params)
+                return cursor
+            except MySQLdb.OperationalError as error:
+                if error.args[0] == ER_QUERY_TIMEOUT:
+                    raise DeadlineExceeded from error
+                self.drop_replica_connection(replica)
+                replica.eject()
+
+        self.connect_to_primary()
+        cursor = self.connection.cursor(cursor_class)
+        try:
+            cursor.execute(self.limit_execution_time(query) if time_limited else query, params)
+        except MySQLdb.OperationalError as error:
+            if error.args[0] == ER_QUERY_TIMEOUT:
+                raise DeadlineExceeded from error
+            raise
+        return cursor
+
     def execute_query(self, query, params=None):
         """Execute a query and put the results on the cursor.
 
@@ -55,10 +420,11 @@ class MySQL:
 
         """
 
+        # The connection uses autocommit, so the query is committed right away
+        self.connect_to_primary()
         self.cursor.execute(query, params)
-        self.connection.commit()
 
-    def fetch_rows(self, query, params=None):
+    def fetch_rows(self, query, params=None, max_staleness=MYSQL_MAX_REPLICA_LAG):
         """Fetch rows.
 
         Parameters
@@ -67,6 +433,9 @@ class MySQL:
             Query
         params : Dict[str, Union[str, int, float, datetime]]
             Parameters to be used with the query
+        max_staleness : float
+            Maximum amount of seconds the data may lag behind the primary
+            (0 to always read from the primary, None when any lag is acceptable)
 
         Returns
         -------
@@ -75,11 +444,11 @@ class MySQL:
 
         """
 
-        self.execute_query(query, params)
-        result = self.cursor.fetchall()
+        cursor = self.execute_read(query, params, max_staleness)
+        result = cursor.fetchall()
         return result
 
-    def fetch_row(self, query, params=None):
+    def fetch_row(self, query, params=None, max_staleness=MYSQL_MAX_REPLICA_LAG):
         """Fetch a row.
 
         Parameters
@@ -89,6 +458,9 @@ class MySQL:
             (when more row are returned, only the first is returned)
         params : Dict[str, Union[str, int, float, datetime]]
             Parameters to be used with the query
+        max_staleness : float
+            Maximum amount of seconds the data may lag behind the primary
+            (0 to always read from the primary, None when any lag is acceptable)
 
         Returns
         -------
@@ -97,11 +469,11 @@ class MySQL:
 
         """
 
-        self.execute_query(query, params)
-        result = self.cursor.fetchone()
+        cursor = self.execute_read(query, params, max_staleness)
+        result = cursor.fetchone()
         return result
 
-    def fetch_value(self, query, params=None):
+    def fetch_value(self, query, params=None, max_staleness=MYSQL_MAX_REPLICA_LAG):
         """Fetch a single value.
 
         Parameters
@@ -111,6 +483,9 @@ class MySQL:
             (when more values are returned, only the first is returned)
         params : Dict[str, Union[str, int, float, datetime]]
             Parameters to be used with the query
+        max_staleness : float
+            Maximum amount of seconds the data may lag behind the primary
+            (0 to always read from the primary, None when any lag is acceptable)
 
         Returns
         -------
@@ -119,10 +494,78 @@ class MySQL:
 
         """
 
-        self.execute_query(query, params)
-        result = self.cursor.fetchone()
+        cursor = self.execute_read(query, params, max_staleness)
+        result = cursor.fetchone()
         return list(result.values())[0]
 
+    def stream_rows(self, query, params=None, batch_size=STREAM_BATCH_SIZE,
+                    max_staleness=MYSQL_MAX_REPLICA_LAG):
+        """Stream rows from a server-side cursor, without materialising the full result.
+
+        The query is executed right away, so connection errors and a passed deadline are raised
+        by this call. The rows are then read while iterating, without a time limit.
+
+        The connection cannot be used for other queries until the rows are exhausted, so use a
+        dedicated instance of this class for streaming. When the iteration is stopped before the
+        rows are exhausted, the connections of this instance are closed (instead of reading the
+        remaining rows).
+
+        Parameters
+        ----------
+        query : str
+            Query
+        params : Dict[str, Union[str, int, float, datetime]]
+            Parameters to be used with the query
+        batch_size : int
+            Amount of rows to fetch from the server per round trip
+        max_staleness : float
+            Maximum amount of seconds the data may lag behind the primary
+            (0 to always read from the primary, None when any lag is acceptable)
+
+        Returns
+        -------
+        Iterator[Dict[str, Union[str, int, float, datetime]]]
+            The rows of the result of the database query
+
+        """
+
+        cursor = self.execute_read(query, params, max_staleness, cursors.SSDictCursor,
+                                   time_limited=False)
+
+        return self.generate_rows(cursor, batch_size)
+
+    def generate_rows(self, cursor, batch_size):
+        """Generate the rows of an unbuffered cursor, fetching them in batches.
+
+        Parameters
+        ----------
+        cursor : MySQLdb.cursors.SSDictCursor
+            Cursor on which a query was executed
+        batch_size : int
+            Amount of rows to fetch from the server per round trip
+
+        Yields
+        ------
+        Dict[str, Union[str, int, float, datetime]]
+            A single row of the result of the database query
+
+        """
+
+        exhausted = False
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            exhausted = True
+        finally:
+            # Closing an unbuffered cursor reads all remaining rows, closing the connection doesn't
+            if exhausted:
+                cursor.close()
+            else:
+                self.close_connection()
+
     def replace_into(self, table_name, values):
         """Replace a row into a specific database table."""
 
@@ -138,10 +581,18 @@ class MySQL:
 
         # Execute the query and commit the results
         self.execute_query(query, tuple(values))
+        ROWS_WRITTEN.add(table_name)
 
         return self.cursor.lastrowid
 
     def close_connection(self):
-        """Close the database connection."""
+        """Close the database connections (does nothing when they are closed already)."""
+
+        for connection in self.replica_connections.values():
+            connection.close()
+        self.replica_connections = {}
 
-        return self.connection.close()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            self.cursor = None
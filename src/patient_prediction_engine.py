@@ -5,7 +5,7 @@ Author: Bas Vonk
 Date: 2019-04-01
 """
 
-import math
+import numpy as np
 import pandas as pd
 
 CONSTANT = -5
@@ -80,6 +80,65 @@ class PatientPredictionEngine:
             'temperature__std': features.loc['temperature', 'std']
         }
 
+    def get_features_over_time(self, df_records):
+        """Get the features as they were known at every measurement time.
+
+        The features are computed with expanding aggregations over all records, so this gives
+        the same result as calling get_features on the records up to each measurement time,
+        without recomputing the aggregations for every time.
+
+        Parameters
+        ----------
+        df_records : pd.DataFrame
+            Pandas dataframe with the signal values (contains columns 'name', 'time' and 'value')
+
+        Returns
+        -------
+        pd.DataFrame
+            Pandas dataframe indexed by measurement time with a column for each feature. Times
+            before all required signals have been measured are left out.
+
+        """
+
+        df_records = df_records.sort_values(by=['time'], kind='mergesort')
+        grouped = df_records.groupby('name')['value']
+
+        # Running mean and standard deviation from cumulative sums. The values are shifted by the
+        # first value of their signal first, which does not change the standard deviation but
+        # keeps the sum of squares small (avoiding loss of precision)
+        count = grouped.cumcount() + 1
+        shifted = df_records['value'] - grouped.transform('first')
+        shifted_sum = shifted.groupby(df_records['name']).cumsum()
+        shifted_sum_sq = (shifted ** 2).groupby(df_records['name']).cumsum()
+        variance = (shifted_sum_sq - shifted_sum ** 2 / count) / (count - 1)
+
+        df_records = df_records.assign(
+            mean=grouped.cumsum() / count,
+            std=np.sqrt(variance.clip(lower=0).where(count > 1)),
+        )
+
+        # Take the state after the last record at each time and carry it forward to the times at
+        # which the signal was not measured
+        df_state = df_records.groupby(['time', 'name'])[['value', 'mean', 'std']].last() \
+            .unstack('name').ffill()
+
+        for signal in ['blood_pressure', 'respiration_rate', 'temperature']:
+            if signal not in df_state['value'].columns:
+                return pd.DataFrame(columns=['age', 'blood_pressure__last',
+                                             'respiration_rate__mean', 'temperature__std'])
+
+        df_features = pd.DataFrame({
+            'age': self.patient['age'],
+            'blood_pressure__last': df_state['value', 'blood_pressure'],
+            'respiration_rate__mean': df_state['mean', 'respiration_rate'],
+            'temperature__std': df_state['std', 'temperature']
+        })
+
+        required_signals_measured = df_state['value'][
+            ['blood_pressure', 'respiration_rate', 'temperature']].notna().all(axis=1)
+
+        return df_features[required_signals_measured]
+
     @staticmethod
     def predict(features):
         """Make and return a prediction.
@@ -101,14 +160,33 @@ class PatientPredictionEngine:
         assert 'respiration_rate__mean' in features, "'respirate rate' feature is missing."
         assert 'temperature__std' in features, "'temperate' feature is missing."
 
+        return float(PatientPredictionEngine.predict_batch(features))
+
+    @staticmethod
+    def predict_batch(df_features):
+        """Make and return predictions for many feature sets at once.
+
+        Parameters
+        ----------
+        df_features : pd.DataFrame
+            Pandas dataframe with a column for each feature and a row per feature set (a
+            dictionary with a single feature set works too, giving a single probability).
+
+        Returns
+        -------
+        pd.Series
+            A series with a risk probability per row of df_features
+
+        """
+
         # This is the model (in practice this will probably be a .pickle file)
         x_beta = CONSTANT + \
-            COEFF_AGE * features['age'] + \
-            COEFF_BLOOD_PRESSURE_LAST * features['blood_pressure__last'] + \
-            COEFF_RESPIRATION_RATE_MEAN * features['respiration_rate__mean'] + \
-            COEFF_TEMPERATURE_STD * features['temperature__std']
+            COEFF_AGE * df_features['age'] + \
+            COEFF_BLOOD_PRESSURE_LAST * df_features['blood_pressure__last'] + \
+            COEFF_RESPIRATION_RATE_MEAN * df_features['respiration_rate__mean'] + \
+            COEFF_TEMPERATURE_STD * df_features['temperature__std']
 
-        return math.exp(x_beta) / (1 + math.exp(x_beta))
+        return np.exp(x_beta) / (1 + np.exp(x_beta))
 
     def get_prediction(self):
         """Get a prediction for the patient."""
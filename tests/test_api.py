@@ -0,0 +1,228 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Tests for the signal value export endpoints."""
+
+from datetime import datetime, timedelta
+from itertools import islice
+import gzip
+import json
+import pytest
+from src import mysql_adapter
+from src.api import app, EXPORT_LIMITER
+
+DATETIME_ADMISSION = datetime(2019, 1, 1)
+SIGNAL_IDS = {'blood_pressure': 1, 'respiration_rate': 2, 'temperature': 3}
+
+
+class FakeDatabase:
+    """Stand-in for the MySQL server, answers the queries of the export endpoints.
+
+    Attributes
+    ----------
+    executed : List[Tuple[str, Dict[str, Union[tuple, datetime]]]]
+        The query and parameters of every executed query.
+    connections : List[FakeConnection]
+        Every connection that was made.
+    export_minutes : int
+        Amount of minutes of signal values an export returns (a value per signal per minute).
+
+    """
+
+    def __init__(self):
+
+        self.executed = []
+        self.connections = []
+        self.export_minutes = 3
+
+    def connect(self, **config):
+        """Connect to the stand-in."""
+
+        connection = FakeConnection(self)
+        self.connections.append(connection)
+        return connection
+
+
+class FakeConnection:
+    """Stand-in for a MySQL connection."""
+
+    def __init__(self, database):
+
+        self.database = database
+        self.cursors = []
+        self.closed = False
+
+    def cursor(self, cursor_class=None):
+        """Get a cursor."""
+
+        cursor = FakeCursor(self)
+        self.cursors.append(cursor)
+        return cursor
+
+    def autocommit(self, on):
+        """Set autocommit."""
+
+    def commit(self):
+        """Commit."""
+
+    def close(self):
+        """Close the connection."""
+
+        self.closed = True
+
+
+class FakeCursor:
+    """Stand-in for a MySQL cursor."""
+
+    def __init__(self, connection):
+
+        self.connection = connection
+        self.rows = iter([])
+        self.closed = False
+
+    def execute(self, query, params=None):
+        """Execute a query."""
+
+        database = self.connection.database
+        database.executed.append((query, params))
+
+        if "MAX(time)" in query:
+            self.rows = iter([{'MAX(time)': DATETIME_ADMISSION}])
+        elif "FROM signals" in query:
+            self.rows = iter([{'id': SIGNAL_IDS[name]} for name in params['signal_names']
+                              if name in SIGNAL_IDS])
+        elif "patient_signal_values" in query:
+            self.rows = (
+                {'patient_id': patient_id, 'name': name, 'value': 37.0,
+                 'time': DATETIME_ADMISSION + timedelta(minutes=minute)}
+                for patient_id in params['patient_ids']
+                for name in SIGNAL_IDS
+                for minute in range(database.export_minutes)
+            )
+
+    def fetchone(self):
+        """Fetch a row."""
+
+        return next(self.rows)
+
+    def fetchall(self):
+        """Fetch all rows."""
+
+        return list(self.rows)
+
+    def fetchmany(self, size):
+        """Fetch a batch of rows."""
+
+        return list(islice(self.rows, size))
+
+    def close(self):
+        """Close the cursor."""
+
+        self.closed = True
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """Get a fake database that only has a primary."""
+
+    database = FakeDatabase()
+    monkeypatch.setattr(mysql_adapter.MySQLdb, 'connect', database.connect)
+    monkeypatch.setattr(mysql_adapter, 'REPLICAS', [])
+
+    return database
+
+
+@pytest.fixture
+def client():
+    """Get a test client for the API (read the responses with buffered=True, to release slots)."""
+
+    return app.test_client()
+
+
+def get_export_query(database):
+    """Get the query and parameters of the export."""
+
+    return next((query, params) for query, params in database.executed
+                if "psv.patient_id IN" in query)
+
+
+def test_export_is_ndjson(database, client):
+    """Every line of an export should be a JSON object with a signal value."""
+
+    response = client.get('/api/patients/1/signals', buffered=True)
+    lines = response.get_data(as_text=True).splitlines()
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(lines) == len(SIGNAL_IDS) * database.export_minutes
+    assert json.loads(lines[0]) == {'patient_id': 1, 'name': 'blood_pressure', 'value': 37.0,
+                                    'time': '2019-01-01T00:00:00'}
+
+
+def test_export_filters(database, client):
+    """The patients, time range and signals of the query string should be passed to the query."""
+
+    response = client.get('/api/patients/signals?patient_ids=1,2&from=2019-01-01T01:00:00'
+                          '&to=2019-01-02T00:00:00&signals=temperature,heart_rate', buffered=True)
+    query, params = get_export_query(database)
+
+    assert response.status_code == 200
+    assert "psv.signal_id IN" in query
+    assert params == {'patient_ids': (1, 2), 'datetime_from': datetime(2019, 1, 1, 1),
+                      'datetime_to': datetime(2019, 1, 2), 'signal_ids': (3, )}
+
+
+def test_export_of_unknown_signals_is_empty(database, client):
+    """Signal names that don't exist should give an empty export without querying the values."""
+
+    response = client.get('/api/patients/1/signals?signals=heart_rate', buffered=True)
+
+    assert response.status_code == 200
+    assert response.get_data() == b''
+    assert not any("psv.patient_id IN" in query for query, _ in database.executed)
+
+
+def test_export_is_gzip_compressed(database, client):
+    """The export should be gzip compressed when the client accepts it."""
+
+    response = client.get('/api/patients/1/signals', headers={'Accept-Encoding': 'gzip'},
+                          buffered=True)
+    lines = gzip.decompress(response.get_data()).decode('utf-8').splitlines()
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert len(lines) == len(SIGNAL_IDS) * database.export_minutes
+
+
+@pytest.mark.parametrize('path', [
+    '/api/patients/signals',
+    '/api/patients/signals?patient_ids=1,a',
+    '/api/patients/1/signals?from=yesterday',
+])
+def test_invalid_parameters_are_rejected(database, client, path):
+    """Invalid parameters should give a 400 with a JSON error."""
+
+    response = client.get(path, buffered=True)
+
+    assert response.status_code == 400
+    assert response.get_json()['errors'][0]['detail']
+
+
+def test_abandoned_export_closes_connection(database, client):
+    """Closing an export early should close its connection (not drain the cursor) and slot."""
+
+    database.export_minutes = 10**6
+    response = client.get('/api/patients/1/signals', buffered=False)
+    next(iter(response.response))
+    response.close()
+
+    export_connection = database.connections[-1]
+    export_cursor = export_connection.cursors[-1]
+
+    assert export_connection.closed
+    assert not export_cursor.closed
+
+    # All slots should be free again
+    slots = [EXPORT_LIMITER.acquire(EXPORT_LIMITER.get_deadline())
+             for _ in range(EXPORT_LIMITER.max_concurrent)]
+    for _ in filter(None, slots):
+        EXPORT_LIMITER.release()
+    assert all(slots)
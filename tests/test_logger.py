@@ -0,0 +1,138 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Tests for the rate limiting, summaries and queue of the logging."""
+
+import logging
+import queue
+import pytest
+from src import logger as logger_module
+from src.logger import NonBlockingQueueHandler, PeriodicSummary, RateLimitFilter
+
+
+class FakeClock:
+    """Stand-in for time.monotonic that only moves when told to.
+
+    Attributes
+    ----------
+    now : float
+        The current monotonic time.
+
+    """
+
+    def __init__(self):
+
+        self.now = 1000.0
+
+    def __call__(self):
+
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Get a fake clock for the logging module."""
+
+    clock = FakeClock()
+    monkeypatch.setattr(logger_module, 'monotonic', clock)
+
+    return clock
+
+
+def make_record(level=logging.INFO, name='Test'):
+    """Make a log record."""
+
+    return logging.makeLogRecord({'name': name, 'levelno': level, 'msg': "Event"})
+
+
+def test_rate_limit(clock):
+    """At most max_per_second records should pass, and tokens should be added over time."""
+
+    log_filter = RateLimitFilter(max_per_second=2)
+
+    assert [log_filter.filter(make_record()) for _ in range(3)] == [True, True, False]
+
+    clock.now += 1
+    assert [log_filter.filter(make_record()) for _ in range(3)] == [True, True, False]
+    assert log_filter.suppressed == 2
+
+
+def test_warnings_are_never_filtered(clock, monkeypatch):
+    """Warnings and errors should pass, also when the limit is reached or they aren't sampled."""
+
+    monkeypatch.setattr(logger_module, 'random', lambda: 0.99)
+    log_filter = RateLimitFilter(max_per_second=1, sample_rate=0.5)
+    log_filter.filter(make_record())
+
+    assert log_filter.filter(make_record(logging.WARNING))
+    assert log_filter.filter(make_record(logging.ERROR))
+    assert log_filter.suppressed == 1
+
+
+def test_sampling(clock, monkeypatch):
+    """Only records for which the random number is below the sample rate should pass."""
+
+    log_filter = RateLimitFilter(sample_rate=0.25)
+    results = []
+    for random_number in [0.1, 0.3, 0.2, 0.9]:
+        monkeypatch.setattr(logger_module, 'random', lambda: random_number)
+        results.append(log_filter.filter(make_record()))
+
+    assert results == [True, False, True, False]
+    assert log_filter.suppressed == 2
+
+
+def test_suppressed_records_are_summarized(clock):
+    """Filtered records should be counted in the periodic summary, per logger."""
+
+    logger_module.SUPPRESSED_RECORDS.flush()
+    log_filter = RateLimitFilter(max_per_second=1)
+    for _ in range(3):
+        log_filter.filter(make_record(name='Noisy'))
+
+    assert logger_module.SUPPRESSED_RECORDS.counts['Noisy'] == 2
+
+
+def test_periodic_summary(clock, caplog):
+    """The summary should be logged with the counts once the interval passed, then start over."""
+
+    caplog.set_level(logging.INFO, logger='Test summary')
+    summary = PeriodicSummary(logging.getLogger('Test summary'), "Events", interval=10)
+
+    summary.add('a')
+    summary.add('b', 2)
+    assert not caplog.records
+
+    clock.now += 10
+    summary.add('a')
+
+    assert [record.getMessage() for record in caplog.records] == \
+        ["Events in the last 10.0 seconds: 4 (a: 2, b: 2)"]
+    assert not summary.counts
+    assert summary.started_at == clock.now
+
+
+def test_periodic_summary_does_not_count_when_disabled(clock):
+    """Events should not be counted when the summary wouldn't be logged."""
+
+    summary = PeriodicSummary(logging.getLogger('Test summary'), "Events")
+
+    logging.disable(logging.CRITICAL)
+    try:
+        summary.add('a')
+    finally:
+        logging.disable(logging.NOTSET)
+
+    assert not summary.counts
+
+
+def test_full_queue_drops_records():
+    """Records should be dropped (and counted) instead of blocking when the queue is full."""
+
+    handler = NonBlockingQueueHandler()
+    handler.stop()
+    handler.queue = queue.Queue(maxsize=1)
+
+    for _ in range(3):
+        handler.handle(make_record())
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
@@ -0,0 +1,246 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Tests for the read/write splitting of the MySQL adapter."""
+
+from itertools import count
+from time import monotonic, sleep
+import MySQLdb
+import pytest
+from src import mysql_adapter
+from src.mysql_adapter import DeadlineExceeded, MySQL, Replica
+
+ER_TABLEACCESS_DENIED_ERROR = 1142
+CR_CONN_HOST_ERROR = 2003
+CR_SERVER_LOST = 2013
+
+
+class FakeServer:
+    """Stand-in for the MySQL servers, records which server executed which query.
+
+    Attributes
+    ----------
+    executed : List[Tuple[str, str]]
+        The hostname and query of every executed query.
+    down : Set[str]
+        Hostnames of the servers that can't be reached.
+    timing_out : Set[str]
+        Hostnames of the servers to which connecting takes until the connect timeout.
+    lags : Dict[str, float]
+        Lag in seconds per replica hostname.
+    heartbeat_denied : bool
+        Whether reading the heartbeat table fails because of missing privileges.
+
+    """
+
+    def __init__(self):
+
+        self.executed = []
+        self.down = set()
+        self.timing_out = set()
+        self.lags = {}
+        self.heartbeat_denied = False
+
+    def connect(self, host, connect_timeout=None, **config):
+        """Connect to a server."""
+
+        if host in self.timing_out:
+            sleep(connect_timeout)
+            raise MySQLdb.OperationalError(CR_CONN_HOST_ERROR, "Can't connect to MySQL server")
+
+        if host in self.down:
+            raise MySQLdb.OperationalError(CR_SERVER_LOST, "Lost connection to MySQL server")
+
+        return FakeConnection(self, host)
+
+
+class FakeConnection:
+    """Stand-in for a MySQL connection."""
+
+    def __init__(self, server, host):
+
+        self.server = server
+        self.host = host
+
+    def cursor(self, cursor_class=None):
+        """Get a cursor."""
+
+        return FakeCursor(self)
+
+    def autocommit(self, on):
+        """Set autocommit."""
+
+    def commit(self):
+        """Commit."""
+
+    def close(self):
+        """Close the connection."""
+
+
+class FakeCursor:
+    """Stand-in for a MySQL cursor, every query returns the hostname of the server."""
+
+    def __init__(self, connection):
+
+        self.connection = connection
+        self.rows = []
+        self.lastrowid = 1
+
+    def execute(self, query, params=None):
+        """Execute a query."""
+
+        server = self.connection.server
+        host = self.connection.host
+
+        if host in server.down:
+            raise MySQLdb.OperationalError(CR_SERVER_LOST, "Lost connection to MySQL server")
+
+        if 'heartbeat' in query:
+            if server.heartbeat_denied:
+                raise MySQLdb.OperationalError(ER_TABLEACCESS_DENIED_ERROR,
+                                               "SELECT command denied to user")
+            self.rows = [{'lag': server.lags.get(host, 0) * 10**6}]
+            return
+
+        server.executed.append((host, query))
+        self.rows = [{'host': host}]
+
+    def fetchone(self):
+        """Fetch a row."""
+
+        return self.rows[0]
+
+    def fetchall(self):
+        """Fetch all rows."""
+
+        return self.rows
+
+    def close(self):
+        """Close the cursor."""
+
+
+@pytest.fixture
+def server(monkeypatch):
+    """Get a fake server with a primary and two replicas (replica_1 and replica_2)."""
+
+    server = FakeServer()
+    monkeypatch.setattr(mysql_adapter.MySQLdb, 'connect', server.connect)
+    monkeypatch.setattr(mysql_adapter, 'MYSQL_CONFIG', {'host': 'primary'})
+    monkeypatch.setattr(mysql_adapter, 'REPLICAS',
+                        [Replica({'host': 'replica_1'}), Replica({'host': 'replica_2'})])
+    monkeypatch.setattr(mysql_adapter, 'REPLICA_COUNTER', count())
+
+    return server
+
+
+def test_reads_are_spread_over_replicas(server):
+    """Reads should go round-robin to the replicas, without connecting to the primary."""
+
+    mysql_obj = MySQL()
+    hosts = [mysql_obj.fetch_value("SELECT 1") for _ in range(4)]
+
+    assert hosts == ['replica_1', 'replica_2', 'replica_1', 'replica_2']
+    assert mysql_obj.connection is None
+
+
+def test_writes_go_to_primary(server):
+    """Writes should go to the primary."""
+
+    MySQL().replace_into('patients', {'id': 1})
+
+    assert server.executed[-1][0] == 'primary'
+
+
+def test_failed_replica_is_ejected(server):
+    """A replica that can't be reached should be skipped, also by other adapter instances."""
+
+    server.down.add('replica_1')
+    hosts = [MySQL().fetch_value("SELECT 1") for _ in range(4)]
+
+    assert hosts == ['replica_2'] * 4
+    assert not mysql_adapter.REPLICAS[0].is_available()
+    assert mysql_adapter.REPLICAS[1].is_available()
+
+
+def test_reads_fall_back_to_primary(server):
+    """When no replica can be reached, reads should go to the primary."""
+
+    server.down.update(['replica_1', 'replica_2'])
+
+    assert MySQL().fetch_value("SELECT 1") == 'primary'
+
+
+def test_max_staleness_zero_reads_from_primary(server):
+    """A read that can't accept any lag should go to the primary."""
+
+    assert MySQL().fetch_value("SELECT 1", max_staleness=0) == 'primary'
+
+
+def test_lagging_replica_is_skipped(server):
+    """A replica that lags more than max_staleness should be skipped."""
+
+    server.lags['replica_1'] = 10
+    mysql_obj = MySQL()
+
+    assert [mysql_obj.fetch_value("SELECT 1", max_staleness=5) for _ in range(2)] == \
+        ['replica_2', 'replica_2']
+    assert mysql_obj.fetch_value("SELECT 1", max_staleness=None) in {'replica_1', 'replica_2'}
+
+
+def test_lag_grows_since_last_check(server, monkeypatch):
+    """The time since the lag was measured should count as lag, until it's measured again."""
+
+    monkeypatch.setattr(mysql_adapter, 'REPLICA_LAG_CHECK_INTERVAL_SECONDS', 10)
+    server.lags['replica_1'] = 2
+    mysql_obj = MySQL()
+    mysql_obj.get_read_replicas(max_staleness=5)
+
+    # Measured 3 seconds ago, so replica_1 may be 2 + 3 + 1 (heartbeat) seconds behind by now
+    mysql_adapter.REPLICAS[0].lag_checked_at -= 3
+
+    assert [mysql_obj.fetch_value("SELECT 1", max_staleness=5) for _ in range(2)] == \
+        ['replica_2', 'replica_2']
+    assert {mysql_obj.fetch_value("SELECT 1", max_staleness=7) for _ in range(2)} == \
+        {'replica_1', 'replica_2'}
+
+
+def test_missing_privileges_do_not_eject_replicas(server):
+    """When the lag can't be measured, replicas are skipped for reads with a max_staleness only."""
+
+    server.heartbeat_denied = True
+    mysql_obj = MySQL()
+
+    assert mysql_obj.fetch_value("SELECT 1", max_staleness=5) == 'primary'
+    assert all(replica.is_available() for replica in mysql_adapter.REPLICAS)
+    assert mysql_obj.fetch_value("SELECT 1", max_staleness=None) in {'replica_1', 'replica_2'}
+
+
+def test_reads_are_time_limited_without_extra_round_trips(server):
+    """A read with a deadline should carry its time limit, and be the only query that's sent."""
+
+    for max_staleness in [None, 0]:
+        server.executed = []
+        MySQL(deadline=monotonic() + 5).fetch_value("SELECT 1", max_staleness=max_staleness)
+
+        assert len(server.executed) == 1
+        assert server.executed[0][1].startswith("SELECT /*+ MAX_EXECUTION_TIME(")
+
+
+def test_connect_cut_short_by_deadline_does_not_eject(server):
+    """A replica connect that times out at the deadline, not at its own timeout, isn't a failure."""
+
+    server.timing_out.add('replica_1')
+    mysql_obj = MySQL(deadline=monotonic() + 0.2)
+
+    with pytest.raises(DeadlineExceeded):
+        mysql_obj.fetch_value("SELECT 1", max_staleness=None)
+    assert mysql_adapter.REPLICAS[0].is_available()
+
+
+def test_connect_timeout_ejects(server, monkeypatch):
+    """A replica connect that runs out of its own timeout before the deadline should eject it."""
+
+    monkeypatch.setattr(mysql_adapter, 'REPLICA_CONNECT_TIMEOUT_SECONDS', 0.1)
+    server.timing_out.add('replica_1')
+
+    assert MySQL(deadline=monotonic() + 5).fetch_value("SELECT 1", max_staleness=None) == \
+        'replica_2'
+    assert not mysql_adapter.REPLICAS[0].is_available()
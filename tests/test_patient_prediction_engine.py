@@ -0,0 +1,80 @@
+# -*- encoding: utf-8 -*-
+"""ICU Prediction API: Tests for the Patient Prediction Engine."""
+
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import pytest
+from src.patient_prediction_engine import PatientPredictionEngine
+
+SIGNALS = {
+    'blood_pressure': (64.59, 7.91),
+    'respiration_rate': (21.38, 4.54),
+    'temperature': (37.11, 0.32)
+}
+
+
+class FakeICUModel:
+    """Stand-in for the ICUModel that only knows a single patient."""
+
+    def get_patient(self, patient_id):
+        """Get a patient."""
+
+        return {'id': patient_id, 'age': 64}
+
+
+@pytest.fixture
+def prediction_engine_obj():
+    """Get a prediction engine for a patient of the FakeICUModel."""
+
+    return PatientPredictionEngine(1, FakeICUModel())
+
+
+@pytest.fixture
+def df_records():
+    """Get random signal values for a stay of ten hours (at most one value per signal per time)."""
+
+    random_state = np.random.RandomState(42)
+    datetime_admission = datetime(2019, 1, 1)
+
+    records = [
+        {
+            'name': name,
+            'time': datetime_admission + timedelta(minutes=minute),
+            'value': random_state.normal(mean, std)
+        }
+        for minute in range(600)
+        for name, (mean, std) in SIGNALS.items()
+        if random_state.random_sample() < 0.1
+    ]
+
+    return pd.DataFrame(records)
+
+
+def test_features_over_time_match_features(prediction_engine_obj, df_records):
+    """The features over time should equal the features of the records up to each time."""
+
+    df_features = prediction_engine_obj.get_features_over_time(df_records)
+
+    for time in df_records['time'].unique():
+
+        df_records_until_time = df_records[df_records['time'] <= time].copy()
+
+        if set(df_records_until_time['name']) != set(SIGNALS):
+            assert time not in df_features.index
+            continue
+
+        features = prediction_engine_obj.get_features(df_records_until_time)
+        for name, value in features.items():
+            assert df_features.loc[time, name] == pytest.approx(value, rel=1e-9, nan_ok=True)
+
+
+def test_predict_batch_matches_predict(prediction_engine_obj, df_records):
+    """Scoring the features over time at once should equal scoring them one by one."""
+
+    df_features = prediction_engine_obj.get_features_over_time(df_records).dropna()
+    predictions = prediction_engine_obj.predict_batch(df_features)
+
+    assert not df_features.empty
+    for time, features in df_features.iterrows():
+        assert predictions[time] == pytest.approx(prediction_engine_obj.predict(features))